@@ -1,6 +1,67 @@
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 import altair as alt
 
+# copy-on-write makes shallow copies and assign() safe without duplicating column data;
+# it is always on from pandas 3.0, where the option is deprecated (and removed in 4.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def _cross_count(by: np.ndarray, out: np.ndarray, nb: int, no: int) -> np.ndarray:
+    """(nb, no) histogram of paired category codes; -1 (missing) codes are skipped.
+
+    The code pairs are flattened to one index and counted with a single
+    np.bincount, which is exact and needs no JIT kernel.
+    """
+    valid = (by >= 0) & (out >= 0)
+    flat = by[valid].astype(np.int64) * no + out[valid]
+    return np.bincount(flat, minlength=nb * no).reshape(nb, no)
+
+
+def _fast_to_datetime(s: pd.Series) -> pd.Series:
+    """Parse `s` to datetimes, converting each distinct value only once.
+
+    Hospital extracts repeat the same dates across many patients, so parsing
+    the unique values and broadcasting back is much cheaper than parsing
+    every row.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    codes, uniques = pd.factorize(s)
+    # the explicit ISO8601 format skips format inference. Like pd.to_datetime's own
+    # inference, the first value decides: if it isn't ISO8601, re-parse with the one
+    # format pandas infers from it, so a column is never read partly month-first and
+    # partly day-first; values that don't match either way become NaT
+    try:
+        parsed = pd.to_datetime(uniques, format="ISO8601", errors="coerce")
+    except ValueError:
+        parsed = None
+    if parsed is None or (len(parsed) and pd.isna(parsed[0])):
+        parsed = pd.to_datetime(uniques, errors="coerce")
+    return pd.Series(parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=s.index, name=s.name)
+
+
+MAX_AGE = 120
+
+# bump whenever clean_data's output changes so persisted cleaned frames are invalidated
+CLEAN_VERSION = 2
+
+# alternate spellings of the date columns, in order of preference
+COLUMN_ALIASES = {
+    "admit_date": "admission_date",
+    "date_admitted": "admission_date",
+    "date_discharged": "discharge_date",
+}
+
+
+@lru_cache(maxsize=None)
+def _age_bin_edges(width: int) -> np.ndarray:
+    """Left edges of the `width`-year age bins covering 0..MAX_AGE, built once per width."""
+    return np.arange(0, MAX_AGE + 1, width, dtype=np.int16)
+
 
 class HealthAnalyzer:
     """Analyze hospital patient records.
@@ -16,31 +77,54 @@ class HealthAnalyzer:
     - satisfaction (numeric rating 0-5)
     - diagnosis
 
-    The class holds a cleaned pandas DataFrame in `self.df`.
+    The class holds a cleaned pandas DataFrame in `self.df`. The input is copied
+    unless `copy=False` is passed.
+
+    After `clean_data`, whole-number `age` and `satisfaction` are stored as
+    nullable ``Int8`` to keep the frame small. Arithmetic on them stays in int8
+    and wraps silently (``ha.df["age"] * 2`` turns 100 into -56), so upcast
+    first, e.g. ``ha.df["age"].astype("Int64")`` or ``.astype(float)``.
     """
 
-    def __init__(self, df: pd.DataFrame):
-        self.df = df.copy()
+    def __init__(self, df: pd.DataFrame, copy: bool = True):
+        # under copy-on-write a shallow copy is enough to keep the caller's frame untouched;
+        # pass copy=False when the caller already owns `df` (e.g. a freshly filtered frame)
+        self.df = df.copy(deep=False) if copy else df
+
+    def _choices(self, column):
+        """Sorted distinct values of `column`; O(k) on the categories once cleaned."""
+        ser = self.df[column]
+        if isinstance(ser.dtype, pd.CategoricalDtype):
+            return ser.cat.categories.sort_values().tolist()
+        return sorted(ser.dropna().unique())
+
+    @property
+    def gender_choices(self):
+        return self._choices("gender")
+
+    @property
+    def department_choices(self):
+        return self._choices("department")
 
     def clean_data(self):
         df = self.df
         # normalize column names
         df.columns = [c.strip().lower() for c in df.columns]
 
-        # parse dates if present
-        for col in ("admission_date", "admit_date", "date_admitted"):
-            if col in df.columns:
-                df.rename(columns={col: "admission_date"}, inplace=True)
-                break
-        for col in ("discharge_date", "date_discharged"):
-            if col in df.columns:
-                df.rename(columns={col: "discharge_date"}, inplace=True)
-                break
+        # map alternate date column names onto the canonical ones; as before, an existing
+        # canonical column or an earlier alias wins, so no duplicate columns are created
+        present = set(df.columns)
+        renames = {}
+        for alias, target in COLUMN_ALIASES.items():
+            if alias in present and target not in present and target not in renames.values():
+                renames[alias] = target
+        df.rename(columns=renames, inplace=True)
 
+        # parse dates if present
         if "admission_date" in df.columns:
-            df["admission_date"] = pd.to_datetime(df["admission_date"], errors="coerce")
+            df["admission_date"] = _fast_to_datetime(df["admission_date"])
         if "discharge_date" in df.columns:
-            df["discharge_date"] = pd.to_datetime(df["discharge_date"], errors="coerce")
+            df["discharge_date"] = _fast_to_datetime(df["discharge_date"])
 
         # standardize outcome labels
         if "outcome" in df.columns:
@@ -48,11 +132,24 @@ class HealthAnalyzer:
 
         # ensure numeric age
         if "age" in df.columns:
-            df["age"] = pd.to_numeric(df["age"], errors="coerce")
+            # ages outside 0-MAX_AGE are treated as missing so the Int8 cast can't overflow;
+            # whole-number ages fit in nullable Int8, fractional ages stay float so the
+            # age filter compares the recorded values, as before
+            age = pd.to_numeric(df["age"], errors="coerce")
+            age = age.where(age.between(0, MAX_AGE))
+            if (age.dropna() % 1 == 0).all():
+                age = age.astype("Int8")
+            df["age"] = age
 
         # ensure satisfaction numeric
         if "satisfaction" in df.columns:
-            df["satisfaction"] = pd.to_numeric(df["satisfaction"], errors="coerce")
+            satisfaction = pd.to_numeric(df["satisfaction"], errors="coerce")
+            # whole-number ratings fit in nullable Int8; fractional ratings stay float
+            if satisfaction.dropna().between(-128, 127).all() and (satisfaction.dropna() % 1 == 0).all():
+                satisfaction = satisfaction.astype("Int8")
+            elif pd.api.types.is_unsigned_integer_dtype(satisfaction):
+                satisfaction = satisfaction.astype("int64")
+            df["satisfaction"] = satisfaction
 
         # compute length of stay (days)
         if "admission_date" in df.columns and "discharge_date" in df.columns:
@@ -70,18 +167,39 @@ class HealthAnalyzer:
         else:
             df = df.drop_duplicates()
 
+        # low-cardinality labels as categoricals: small int codes instead of objects
+        categorical = {col: df[col].astype("category") for col in ("gender", "department", "outcome", "diagnosis") if col in df.columns}
+        df = df.assign(**categorical)
+
         self.df = df
         return df
 
     def summarize_outcomes(self, by=None):
         """Return counts and percentages of outcomes. Optionally grouped by `by` column(s)."""
         df = self.df
-        if by:
-            grouped = df.groupby(by)["outcome"].value_counts().unstack(fill_value=0)
+        if isinstance(by, str) and isinstance(df[by].dtype, pd.CategoricalDtype) and isinstance(df["outcome"].dtype, pd.CategoricalDtype):
+            by_cat, out_cat = df[by].cat, df["outcome"].cat
+            counts = _cross_count(by_cat.codes.to_numpy(), out_cat.codes.to_numpy(), len(by_cat.categories), len(out_cat.categories))
+            grouped = pd.DataFrame(
+                counts,
+                index=pd.CategoricalIndex(by_cat.categories, name=by),
+                columns=pd.CategoricalIndex(out_cat.categories, name="outcome"),
+            )
+            # keep only groups and outcomes present in the data, as on object columns
+            grouped = grouped.loc[counts.sum(axis=1) > 0, counts.sum(axis=0) > 0]
+            grouped_pct = grouped.div(grouped.sum(axis=1), axis=0)
+            return grouped, grouped_pct
+        elif by:
+            # sorted groups: unlike aggregate_by's count/mean, this result isn't re-sorted
+            grouped = df.groupby(by, observed=True)["outcome"].value_counts().unstack(fill_value=0)
+            # a categorical outcome reports every category; drop those absent from the data
+            grouped = grouped.loc[:, grouped.sum(axis=0) > 0]
             grouped_pct = grouped.div(grouped.sum(axis=1), axis=0)
             return grouped, grouped_pct
         else:
             counts = df["outcome"].value_counts(dropna=False)
+            # a categorical outcome (e.g. on a filtered frame) reports unused categories as 0
+            counts = counts[counts > 0]
             pct = counts / counts.sum()
             return counts, pct
 
@@ -89,41 +207,48 @@ class HealthAnalyzer:
         """Generic aggregator. If agg=='mean' and value_col provided, compute mean of value_col."""
         df = self.df
         if agg == "count":
-            return df.groupby(column).size().sort_values(ascending=False)
+            return df.groupby(column, observed=True, sort=False).size().sort_values(ascending=False)
         elif agg == "mean" and value_col:
-            return df.groupby(column)[value_col].mean().sort_values(ascending=False)
+            return df.groupby(column, observed=True, sort=False)[value_col].mean().sort_values(ascending=False)
         else:
-            return df.groupby(column).agg(agg)
+            # nothing re-sorts this result, so keep groupby's sorted group order
+            return df.groupby(column, observed=True).agg(agg)
 
-    def admissions_over_time(self, freq="M"):
+    def admissions_over_time(self, freq="ME"):
         """Return a time series (pd.Series) of admission counts resampled at `freq`."""
         df = self.df
         if "admission_date" not in df.columns:
             raise ValueError("admission_date column required")
-        s = df.set_index("admission_date").resample(freq).size()
+        # resample a lightweight series indexed by the dates rather than re-indexing the whole frame
+        s = pd.Series(0, index=pd.DatetimeIndex(df["admission_date"])).resample(freq).size()
         return s
 
     def average_satisfaction_by_department(self):
         if "satisfaction" not in self.df.columns or "department" not in self.df.columns:
             return pd.Series(dtype=float)
-        return self.df.groupby("department")["satisfaction"].mean().sort_values(ascending=False)
+        return self.df.groupby("department", observed=True, sort=False)["satisfaction"].mean().sort_values(ascending=False)
 
     # Simple plotting helpers using Altair
     def plot_outcomes_by_age_hist(self, age_bin_width=10):
         df = self.df.dropna(subset=["age", "outcome"]) if "age" in self.df.columns else self.df
         if df.empty or "age" not in df.columns:
             return None
-        df = df.copy()
-        df["age_bin"] = (df["age"] // age_bin_width).astype(int) * age_bin_width
-        chart = alt.Chart(df).mark_bar().encode(
+        edges = _age_bin_edges(age_bin_width)
+        # clip before the int16 cast so uncleaned frames can't overflow it or index edges[-1]
+        # with negative ages; truncating the clipped ages floors fractional ones
+        ages = np.clip(df["age"].to_numpy(dtype="float64", na_value=np.nan), 0, MAX_AGE).astype(np.int16)
+        df = df.assign(age_bin=edges[np.searchsorted(edges, ages, side="right") - 1])
+        # count server-side so the chart ships one row per (bin, outcome), not one per patient
+        agg = df.groupby(["age_bin", "outcome"], observed=True, sort=False).size().reset_index(name="n")
+        chart = alt.Chart(agg).mark_bar().encode(
             x=alt.X("age_bin:O", title=f"Age bins ({age_bin_width})"),
-            y=alt.Y("count():Q", title="Patients"),
+            y=alt.Y("n:Q", title="Patients"),
             color="outcome:N",
-            tooltip=["age", "outcome", "patient_id"] if "patient_id" in df.columns else ["age", "outcome"]
+            tooltip=["age_bin", "outcome", "n"]
         ).properties(width=700)
         return chart
 
-    def plot_admissions_over_time(self, freq="M"):
+    def plot_admissions_over_time(self, freq="ME"):
         s = self.admissions_over_time(freq=freq)
         df = s.reset_index()
         df.columns = ["date", "admissions"]
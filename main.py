@@ -1,17 +1,25 @@
+import atexit
+import hashlib
+import io
+import os
+import shutil
+import stat
+import tempfile
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+import pyarrow as pa
 
-from health_analyzer import HealthAnalyzer
+from health_analyzer import CLEAN_VERSION, HealthAnalyzer
 
 
 def generate_sample_data(n=500, seed=42):
     rng = np.random.default_rng(seed)
-    start = datetime(2020, 1, 1)
-    admission_dates = [start + timedelta(days=int(x)) for x in rng.integers(0, 1000, size=n)]
+    start = np.datetime64("2020-01-01")
+    admission_dates = start + rng.integers(0, 1000, size=n).astype("timedelta64[D]")
     discharge_offsets = rng.integers(0, 30, size=n)
-    discharge_dates = [d + timedelta(days=int(x)) for d, x in zip(admission_dates, discharge_offsets)]
+    discharge_dates = admission_dates + discharge_offsets.astype("timedelta64[D]")
     outcomes = rng.choice(["discharge", "dama", "death"], size=n, p=[0.85, 0.1, 0.05])
     ages = rng.integers(0, 100, size=n)
     genders = rng.choice(["Male", "Female", "Other"], size=n, p=[0.48, 0.5, 0.02])
@@ -20,7 +28,7 @@ def generate_sample_data(n=500, seed=42):
     diagnosis = rng.choice(["Flu", "COVID-19", "Fracture", "Cancer", "Infection"], size=n)
 
     df = pd.DataFrame({
-        "patient_id": [f"P{i:05d}" for i in range(n)],
+        "patient_id": np.char.add("P", np.char.zfill(np.arange(n).astype(str), 5)),
         "admission_date": admission_dates,
         "discharge_date": discharge_dates,
         "outcome": outcomes,
@@ -33,6 +41,112 @@ def generate_sample_data(n=500, seed=42):
     return df
 
 
+def _clean_frame(df):
+    # deliberately uncached: callers cache on small keys (upload bytes, sample
+    # parameters) rather than hashing and storing the raw frame a second time
+    ha = HealthAnalyzer(df, copy=False)
+    ha.clean_data()
+    return ha.df
+
+
+@st.cache_data(ttl=3600)
+def get_clean_sample(n=500, seed=42):
+    return _clean_frame(generate_sample_data(n, seed))
+
+
+def read_upload(file_bytes):
+    """Parse an uploaded CSV with pyarrow's multi-threaded reader, falling back to the C engine.
+
+    pyarrow rejects ragged rows that the C engine pads with NaN, and keeps duplicate
+    headers as-is where the C engine renames them (``age``, ``age.1``); either case is
+    re-parsed with the C engine so such uploads load as they always have.
+    clean_data still owns the dtype coercion.
+    """
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except ValueError:  # pandas' ParserError wrapping pyarrow's ArrowInvalid
+        df = None
+    if df is None or df.columns.duplicated().any():
+        df = pd.read_csv(io.BytesIO(file_bytes))
+    return df
+
+
+# fixed for the life of the server process, so the disk tier survives script reruns and
+# "Clear cache" (which also clears st.cache_resource) instead of orphaning its files
+PARQUET_CACHE_DIR = os.path.join(tempfile.gettempdir(), f"hc_cache_{os.getpid()}")
+
+
+def parquet_cache_dir():
+    """Private (0700) directory for cleaned uploads, removed when the server exits.
+
+    Returns None if the path exists but is not a private directory of ours, in
+    which case the disk cache is skipped.
+    """
+    try:
+        os.mkdir(PARQUET_CACHE_DIR, 0o700)
+    except FileExistsError:
+        info = os.lstat(PARQUET_CACHE_DIR)
+        if not stat.S_ISDIR(info.st_mode) or info.st_mode & 0o077 or (hasattr(os, "getuid") and info.st_uid != os.getuid()):
+            return None
+    else:
+        # registered once, when this process creates the directory
+        atexit.register(shutil.rmtree, PARQUET_CACHE_DIR, ignore_errors=True)
+    return PARQUET_CACHE_DIR
+
+
+@st.cache_data(max_entries=8)
+def load_and_clean(file_bytes):
+    # second-tier cache on disk: the cleaned frame as Parquet, keyed by the upload's hash
+    # and CLEAN_VERSION; uploads evicted from the bounded in-memory cache, or dropped by
+    # "Clear cache", are read back from here instead of re-parsed and re-cleaned
+    cache_dir = parquet_cache_dir()
+    if cache_dir is None:
+        return _clean_frame(read_upload(file_bytes))
+    path = os.path.join(cache_dir, f"v{CLEAN_VERSION}_{hashlib.sha256(file_bytes).hexdigest()}.parquet")
+    if os.path.exists(path):
+        try:
+            return pd.read_parquet(path)
+        except (OSError, ValueError, TypeError, pa.ArrowException):
+            # unreadable cache file: discard it and re-parse the upload
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    df = _clean_frame(read_upload(file_bytes))
+    # write to a temporary name and move it into place so a partial write is never read back
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".parquet.tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, compression="snappy")
+        os.replace(tmp_path, path)
+    except (OSError, ValueError, TypeError, NotImplementedError, pa.ArrowException):
+        # the disk cache is best-effort; e.g. object columns mixing strings and ints
+        # (as the C-engine fallback can produce) raise ArrowTypeError, a TypeError
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return df
+
+
+def isin_codes(ser, values):
+    """Boolean mask of `ser` (categorical) matching `values`, compared on the integer codes."""
+    wanted = ser.cat.categories.get_indexer(list(values))
+    return np.isin(ser.cat.codes.to_numpy(), wanted[wanted >= 0])
+
+
+def filter_data(df, age_range, genders, departments):
+    # deliberately not st.cache_data: hashing the cleaned frame for the key and
+    # unpickling the cached result each cost more than the single-pass mask
+    # missing ages become NaN, which compares False and drops the row
+    age = df["age"].to_numpy(dtype="float64", na_value=np.nan)
+    lo, hi = age_range
+    g = isin_codes(df["gender"], genders)
+    d = isin_codes(df["department"], departments)
+    mask = np.logical_and.reduce([age >= lo, age <= hi, g, d])
+    return df[mask]
+
+
 st.set_page_config(page_title="Public Health Dashboard", layout="wide")
 
 st.title("Public Health: Patient & Hospital Data Dashboard")
@@ -41,31 +155,32 @@ st.markdown("Upload a CSV of hospital patient records, or use generated sample d
 
 uploaded = st.file_uploader("Upload CSV", type=["csv"] )
 if uploaded is not None:
-    df = pd.read_csv(uploaded)
+    # cache on the raw bytes; the UploadedFile object itself is not hashable
+    df = load_and_clean(uploaded.getvalue())
 else:
     if st.checkbox("Use sample demo dataset", value=True):
-        df = generate_sample_data()
+        df = get_clean_sample()
     else:
         st.info("Upload a CSV or check the sample dataset box.")
         st.stop()
 
-ha = HealthAnalyzer(df)
-ha.clean_data()
+ha = HealthAnalyzer(df, copy=False)
 
 # Sidebar filters
 st.sidebar.header("Filters")
 age_min, age_max = int(ha.df["age"].min()), int(ha.df["age"].max()) if "age" in ha.df.columns else (0,100)
 age_range = st.sidebar.slider("Age range", min_value=0, max_value=120, value=(age_min, min(age_max,120)))
-selected_genders = st.sidebar.multiselect("Gender", options=sorted(ha.df["gender"].unique()), default=sorted(ha.df["gender"].unique()))
-selected_departments = st.sidebar.multiselect("Department", options=sorted(ha.df["department"].unique()), default=sorted(ha.df["department"].unique()))
+selected_genders = st.sidebar.multiselect("Gender", options=ha.gender_choices, default=ha.gender_choices)
+selected_departments = st.sidebar.multiselect("Department", options=ha.department_choices, default=ha.department_choices)
 
-df_filtered = ha.df[(ha.df["age"] >= age_range[0]) & (ha.df["age"] <= age_range[1]) & ha.df["gender"].isin(selected_genders) & ha.df["department"].isin(selected_departments)]
+df_filtered = filter_data(ha.df, age_range, tuple(selected_genders), tuple(selected_departments))
+ha_filtered = HealthAnalyzer(df_filtered, copy=False)
 
 st.header("Key Questions")
 col1, col2 = st.columns(2)
 with col1:
     st.subheader("Outcome distribution by age")
-    chart = HealthAnalyzer(df_filtered).plot_outcomes_by_age_hist(age_bin_width=10)
+    chart = ha_filtered.plot_outcomes_by_age_hist(age_bin_width=10)
     if chart is not None:
         st.altair_chart(chart, use_container_width=True)
     else:
@@ -73,21 +188,21 @@ with col1:
 
 with col2:
     st.subheader("Admissions over time")
-    chart2 = HealthAnalyzer(df_filtered).plot_admissions_over_time(freq="M")
+    chart2 = ha_filtered.plot_admissions_over_time(freq="ME")
     if chart2 is not None:
         st.altair_chart(chart2, use_container_width=True)
     else:
         st.info("No admission_date available.")
 
 st.subheader("Average service satisfaction by department")
-chart3 = HealthAnalyzer(df_filtered).plot_satisfaction_by_department()
+chart3 = ha_filtered.plot_satisfaction_by_department()
 if chart3 is not None:
     st.altair_chart(chart3, use_container_width=True)
 else:
     st.info("No satisfaction data available.")
 
 st.subheader("Summary statistics")
-counts, pct = HealthAnalyzer(df_filtered).summarize_outcomes()
+counts, pct = ha_filtered.summarize_outcomes()
 st.write("Outcome counts:")
 st.dataframe(pd.concat([counts.rename("count"), pct.rename("percent")], axis=1))
 